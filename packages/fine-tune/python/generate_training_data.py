@@ -50,10 +50,62 @@ examples-file (JSON array):
 """
 
 import json
+import os
 import random
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
+try:
+    import orjson  # optional C JSON codec for the dataset I/O
+except ImportError:
+    orjson = None
+
+
+def read_json(path: Path):
+    """Parse a JSON file, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with open(path) as f:
+        return json.load(f)
+
+
+JSONL_FLUSH_BYTES = 4 << 20
+
+
+def _encode_line(item: dict) -> bytes:
+    """Encode one JSONL line, newline included, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE)
+    return (json.dumps(item) + "\n").encode()
+
+
+def write_jsonl(path: Path, items: list[dict]) -> None:
+    """Write one JSON object per line through a JSONL_FLUSH_BYTES write buffer.
+    
+    The whole file is never held in memory, and the OS sees one write per
+    buffer-full.
+    """
+    with open(path, "wb", buffering=JSONL_FLUSH_BYTES) as f:
+        for item in items:
+            f.write(_encode_line(item))
+
+
+# Fixed FunctionGemma markers around each declaration and call
+_DECL_PREFIX = "<start_function_declaration>declaration:"
+_DECL_SUFFIX = "<end_function_declaration>"
+_CALL_PREFIX = "<start_function_call>call:"
+_CALL_SUFFIX = "<end_function_call>"
+
+
+def _format_param(key: str, description: str, param_type: str, enum: list | None = None) -> str:
+    """Format one parameter entry of a tool declaration."""
+    if enum is None:
+        return f"{key}:{{description:<escape>{description}<escape>,type:<escape>{param_type}<escape>}}"
+    enum_str = ",".join(f"<escape>{e}<escape>" for e in enum)
+    return f"{key}:{{description:<escape>{description}<escape>,type:<escape>{param_type}<escape>,enum:[{enum_str}]}}"
+
 
 def format_tool_declaration(tool: dict) -> str:
     """Format a tool definition in FunctionGemma format."""
@@ -64,32 +116,48 @@ def format_tool_declaration(tool: dict) -> str:
     required = params.get("required", [])
     
     # Format parameters
-    param_items = []
-    for key, val in properties.items():
-        param_type = val.get("type", "STRING").upper()
-        param_desc = val.get("description", "")
-        param_str = f'{key}:{{description:<escape>{param_desc}<escape>,type:<escape>{param_type}<escape>'
-        if "enum" in val:
-            enum_str = ",".join(f"<escape>{e}<escape>" for e in val["enum"])
-            param_str += f",enum:[{enum_str}]"
-        param_str += "}"
-        param_items.append(param_str)
+    param_items = [
+        _format_param(key, val.get("description", ""), val.get("type", "STRING").upper(), val.get("enum"))
+        for key, val in properties.items()
+    ]
     
-    params_str = ",".join(param_items)
+    params_str = param_items[0] if len(param_items) == 1 else ",".join(param_items)
     required_str = ",".join(f"<escape>{r}<escape>" for r in required)
     
-    return f'<start_function_declaration>declaration:{name}{{description:<escape>{desc}<escape>,parameters:{{{params_str}}},required:[{required_str}],type:<escape>OBJECT<escape>}}<end_function_declaration>'
+    return f"{_DECL_PREFIX}{name}{{description:<escape>{desc}<escape>,parameters:{{{params_str}}},required:[{required_str}],type:<escape>OBJECT<escape>}}{_DECL_SUFFIX}"
+
+
+# Stdlib json with default settings: its spaced separators are part of the
+# training format, which orjson can't produce. Binding the encoder skips the
+# keyword checks json.dumps makes on every call.
+_encode_arg = json.JSONEncoder().encode
+
+
+def _escape_value(v) -> str:
+    """Render an argument value: dicts and lists as JSON, everything else via str."""
+    if isinstance(v, (dict, list)):
+        return _encode_arg(v)
+    return str(v)
 
 
 def format_function_call(name: str, args: dict) -> str:
     """Format a function call in FunctionGemma format."""
-    def escape_value(v):
-        if isinstance(v, (dict, list)):
-            return json.dumps(v)
-        return str(v)
-    
-    args_str = ",".join(f"{k}:<escape>{escape_value(v)}<escape>" for k, v in args.items())
-    return f'<start_function_call>call:{name}{{{args_str}}}<end_function_call>'
+    # Nearly every call has 1-3 arguments; a fixed f-string skips the generator join
+    items = [(k, _escape_value(v)) for k, v in args.items()]
+    if not items:
+        args_str = ""
+    elif len(items) == 1:
+        (k0, v0), = items
+        args_str = f"{k0}:<escape>{v0}<escape>"
+    elif len(items) == 2:
+        (k0, v0), (k1, v1) = items
+        args_str = f"{k0}:<escape>{v0}<escape>,{k1}:<escape>{v1}<escape>"
+    elif len(items) == 3:
+        (k0, v0), (k1, v1), (k2, v2) = items
+        args_str = f"{k0}:<escape>{v0}<escape>,{k1}:<escape>{v1}<escape>,{k2}:<escape>{v2}<escape>"
+    else:
+        args_str = ",".join(f"{k}:<escape>{v}<escape>" for k, v in items)
+    return f"{_CALL_PREFIX}{name}{{{args_str}}}{_CALL_SUFFIX}"
 
 
 def load_tools(tools_path: Path) -> list[dict]:
@@ -99,40 +167,57 @@ def load_tools(tools_path: Path) -> list[dict]:
     if tools_path.is_dir():
         # Load from directory (multiple files)
         for tool_file in tools_path.glob("*.json"):
-            with open(tool_file) as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    tools.extend(data)
-                else:
-                    tools.append(data)
-    else:
-        # Load from single file
-        with open(tools_path) as f:
-            data = json.load(f)
+            data = read_json(tool_file)
             if isinstance(data, list):
                 tools.extend(data)
             else:
                 tools.append(data)
+    else:
+        # Load from single file
+        data = read_json(tools_path)
+        if isinstance(data, list):
+            tools.extend(data)
+        else:
+            tools.append(data)
     
     return tools
 
 
 def load_examples(examples_path: Path) -> list[dict]:
     """Load training examples from JSON file."""
-    with open(examples_path) as f:
-        return json.load(f)
+    return read_json(examples_path)
+
+
+# Conversation opener shared by every sample
+DEVELOPER_TURN_HEADER = "<bos><start_of_turn>developer\n"
+
 
+@lru_cache(maxsize=64)
+def _format_all_tools(tools_key: str) -> str:
+    """Format the declaration block for a tools list given as its JSON encoding."""
+    return "\n".join(format_tool_declaration(tool) for tool in json.loads(tools_key))
 
-def generate_training_sample(example: dict, tools: list[dict]) -> dict | None:
-    """Generate a single training sample in FunctionGemma format."""
-    # Build the system prompt with tool declarations
-    tool_declarations = "\n".join(format_tool_declaration(tool) for tool in tools)
+
+def build_system_prompt(tools: list[dict]) -> str:
+    """Build the developer-turn system prompt declaring every tool."""
+    # Not sort_keys: declarations follow the property order of the schema
+    tool_declarations = _format_all_tools(json.dumps(tools))
     
-    system_prompt = f"""You are a model that can do function calling with the following functions.
+    return f"""You are a model that can do function calling with the following functions.
 Must use the EXACT format: <start_function_call>call:name{{arg:<escape>val<escape>}}<end_function_call>
 Example: <start_function_call>call:calculate{{expression:<escape>5*12<escape>}}<end_function_call>
 {tool_declarations}"""
 
+
+def generate_training_sample(example: dict, tools: list[dict], system_prompt: str = None) -> dict | None:
+    """Generate a single training sample in FunctionGemma format.
+    
+    The system prompt is identical for every example, so callers generating
+    many samples should build it once with build_system_prompt and pass it in.
+    """
+    if system_prompt is None:
+        system_prompt = build_system_prompt(tools)
+    
     # Get the expected tool call
     tool_calls = example.get("expectedToolCalls", [])
     if not tool_calls:
@@ -143,8 +228,7 @@ Example: <start_function_call>call:calculate{{expression:<escape>5*12<escape>}}<
     function_call = format_function_call(tc["name"], tc["arguments"])
     
     # Full conversation format
-    text = f"""<bos><start_of_turn>developer
-{system_prompt}<end_of_turn>
+    text = f"""{DEVELOPER_TURN_HEADER}{system_prompt}<end_of_turn>
 <start_of_turn>user
 {example["userQuery"]}<end_of_turn>
 <start_of_turn>model
@@ -153,6 +237,50 @@ Example: <start_function_call>call:calculate{{expression:<escape>5*12<escape>}}<
     return {"text": text}
 
 
+# Below this many examples, process startup costs more than the formatting
+PARALLEL_MIN_EXAMPLES = 2000
+
+# Tools and system prompt for worker processes, set once by _init_worker
+_worker_context = None
+
+
+def _init_worker(tools: list[dict], system_prompt: str) -> None:
+    global _worker_context
+    _worker_context = (tools, system_prompt)
+
+
+def _generate_in_worker(example: dict) -> dict | None:
+    return generate_training_sample(example, *_worker_context)
+
+
+def generate_samples(examples: list[dict], tools: list[dict], system_prompt: str) -> list[dict]:
+    """Generate samples for all examples, across processes for large datasets."""
+    # Examples without tool calls produce no sample; drop them before dispatch
+    examples = [ex for ex in examples if ex.get("expectedToolCalls")]
+    if len(examples) < PARALLEL_MIN_EXAMPLES:
+        samples = [generate_training_sample(ex, tools, system_prompt) for ex in examples]
+    else:
+        workers = os.cpu_count() or 1
+        # The shared prompt goes to each worker once, so chunks carry only examples
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(tools, system_prompt)
+        ) as pool:
+            samples = list(pool.map(
+                _generate_in_worker,
+                examples,
+                chunksize=max(1, len(examples) // (4 * workers)),
+            ))
+    return samples
+
+
+def split_samples(samples: list[dict], train_split: float, seed: int) -> tuple[list[dict], list[dict]]:
+    """Shuffle and split into (train, valid): permute indices rather than the sample dicts."""
+    rng = random.Random(seed)
+    order = rng.sample(range(len(samples)), len(samples))
+    split_idx = int(len(samples) * train_split)
+    return [samples[i] for i in order[:split_idx]], [samples[i] for i in order[split_idx:]]
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Generate FunctionGemma training data",
@@ -213,20 +341,12 @@ def main():
     print(f"Loaded {len(examples)} examples from {args.examples_file}")
     
     # Generate training data
-    training_data = []
-    for ex in examples:
-        sample = generate_training_sample(ex, tools)
-        if sample:
-            training_data.append(sample)
+    system_prompt = build_system_prompt(tools)
+    training_data = generate_samples(examples, tools, system_prompt)
     
     print(f"Generated {len(training_data)} training samples")
     
-    # Shuffle and split
-    random.seed(args.seed)
-    random.shuffle(training_data)
-    split_idx = int(len(training_data) * args.train_split)
-    train_data = training_data[:split_idx]
-    valid_data = training_data[split_idx:]
+    train_data, valid_data = split_samples(training_data, args.train_split, args.seed)
     
     # Create output directory
     args.output_dir.mkdir(parents=True, exist_ok=True)
@@ -235,13 +355,8 @@ def main():
     train_file = args.output_dir / "train.jsonl"
     valid_file = args.output_dir / "valid.jsonl"
     
-    with open(train_file, "w") as f:
-        for item in train_data:
-            f.write(json.dumps(item) + "\n")
-    
-    with open(valid_file, "w") as f:
-        for item in valid_data:
-            f.write(json.dumps(item) + "\n")
+    write_jsonl(train_file, train_data)
+    write_jsonl(valid_file, valid_data)
     
     print(f"\n✅ Written {len(train_data)} training samples to {train_file}")
     print(f"✅ Written {len(valid_data)} validation samples to {valid_file}")
@@ -250,7 +365,7 @@ def main():
     print("\n" + "=" * 60)
     print("Sample output (truncated):")
     print("=" * 60)
-    sample_text = training_data[0]["text"]
+    sample_text = (train_data or training_data)[0]["text"]
     print(sample_text[:400] + "..." if len(sample_text) > 400 else sample_text)
     
     return 0
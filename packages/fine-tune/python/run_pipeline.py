@@ -31,23 +31,91 @@ import argparse
 import subprocess
 import sys
 import json
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 
-def run_cmd(cmd: list[str], cwd: Path = None, check: bool = True) -> subprocess.CompletedProcess:
-    """Run a command and return the result."""
+def run_cmd(
+    cmd: list[str], cwd: Path = None, check: bool = True, stream: bool = False
+) -> subprocess.CompletedProcess:
+    """Run a command and return the result.
+    
+    With stream, the child writes straight to this terminal (nothing is
+    buffered here, and result.stdout is None); use it for long stages.
+    Otherwise output is captured and printed when the command exits.
+    """
     print(f"\n🔧 Running: {' '.join(cmd)}")
-    result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
-    if result.stdout:
-        print(result.stdout)
-    if result.stderr:
-        print(result.stderr, file=sys.stderr)
+    if stream:
+        result = subprocess.run(cmd, cwd=cwd)
+    else:
+        result = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+        if result.stdout:
+            print(result.stdout)
+        if result.stderr:
+            print(result.stderr, file=sys.stderr)
     if check and result.returncode != 0:
         print(f"❌ Command failed with exit code {result.returncode}")
         return None
     return result
 
 
+# Minimal FunctionGemma prompt used to smoke-test adapters and the fused model
+TEST_PROMPT = """<bos><start_of_turn>developer
+You are a model that can do function calling.
+Must use: <start_function_call>call:name{arg:<escape>val<escape>}<end_function_call>
+<start_function_declaration>declaration:calculate{description:<escape>Math<escape>,parameters:{},required:[],type:<escape>OBJECT<escape>}<end_function_declaration>
+<end_of_turn>
+<start_of_turn>user
+What is 5 * 12?<end_of_turn>
+<start_of_turn>model
+"""
+
+
+def run_mlx_lm(command: str, argv: list[str]) -> bool:
+    """Run an mlx_lm CLI command (lora, fuse) in this process instead of a new interpreter."""
+    import importlib
+    
+    print(f"\n🔧 Running: mlx_lm {command} {' '.join(argv)}")
+    module = importlib.import_module(f"mlx_lm.{command}")
+    saved_argv = sys.argv
+    sys.argv = [f"mlx_lm.{command}", *argv]
+    try:
+        module.main()
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            print(f"❌ mlx_lm {command} exited with {e.code}")
+            return False
+    except Exception as e:
+        print(f"❌ mlx_lm {command} failed: {e}")
+        return False
+    finally:
+        sys.argv = saved_argv
+    return True
+
+
+def load_adapted_model(args):
+    """Load the base model with its LoRA adapters once and keep it on args.
+    
+    Fusion rewrites this model in place, so the post-fusion test needs no load
+    of its own. With --serial the adapter test shares it too; otherwise that
+    test runs in a worker process and loads separately.
+    """
+    if getattr(args, "mlx_model", None) is None:
+        from mlx_lm import load
+        
+        args.mlx_model = load(args.base_model, adapter_path=str(args.adapter_dir), return_config=True)
+    return args.mlx_model
+
+
+def check_function_call(model, tokenizer) -> bool:
+    """Generate from TEST_PROMPT and check the reply uses FunctionGemma call syntax."""
+    from mlx_lm import generate
+    
+    response = generate(model, tokenizer, prompt=TEST_PROMPT, max_tokens=60, verbose=False)
+    print("Response:", response)
+    return "<start_function_call>call:" in response and "<escape>" in response
+
+
 def step_generate_data(args) -> bool:
     """Step 1: Generate training data."""
     print("\n" + "=" * 60)
@@ -70,8 +138,13 @@ def step_train(args) -> bool:
     print("STEP 2: Train LoRA Adapters")
     print("=" * 60)
     
-    cmd = [
-        sys.executable, "-m", "mlx_lm", "lora",
+    # Fail before loading the model if step 1 didn't produce the data mlx_lm lora reads
+    for name in ("train.jsonl", "valid.jsonl"):
+        if not (args.data_dir / name).exists():
+            print(f"❌ Training data not found: {args.data_dir / name}")
+            return False
+    
+    return run_mlx_lm("lora", [
         "--model", args.base_model,
         "--data", str(args.data_dir),
         "--train",
@@ -80,9 +153,7 @@ def step_train(args) -> bool:
         "--steps-per-report", "30",
         "--steps-per-eval", "50",
         "--adapter-path", str(args.adapter_dir),
-    ]
-    
-    return run_cmd(cmd, cwd=args.base_dir) is not None
+    ])
 
 
 def step_test_adapters(args) -> bool:
@@ -91,36 +162,18 @@ def step_test_adapters(args) -> bool:
     print("STEP 3: Test Adapters (Pre-Fusion)")
     print("=" * 60)
     
-    test_code = f'''
-from mlx_lm import load, generate
-
-model, tokenizer = load("{args.base_model}", adapter_path="{args.adapter_dir}")
-
-prompt = """<bos><start_of_turn>developer
-You are a model that can do function calling.
-Must use: <start_function_call>call:name{{arg:<escape>val<escape>}}<end_function_call>
-<start_function_declaration>declaration:calculate{{description:<escape>Math<escape>,parameters:{{}},required:[],type:<escape>OBJECT<escape>}}<end_function_declaration>
-<end_of_turn>
-<start_of_turn>user
-What is 5 * 12?<end_of_turn>
-<start_of_turn>model
-"""
-
-response = generate(model, tokenizer, prompt=prompt, max_tokens=60, verbose=False)
-print("Response:", response)
-
-# Validate format
-if "<start_function_call>call:" in response and "<escape>" in response:
-    print("✅ Adapter test PASSED - correct FunctionGemma format")
-    exit(0)
-else:
-    print("❌ Adapter test FAILED - incorrect format")
-    exit(1)
-'''
+    try:
+        model, tokenizer, _ = load_adapted_model(args)
+        passed = check_function_call(model, tokenizer)
+    except Exception as e:
+        print(f"❌ Adapter test error: {e}")
+        return False
     
-    cmd = [sys.executable, "-c", test_code]
-    result = run_cmd(cmd, cwd=args.base_dir, check=False)
-    return result is not None and result.returncode == 0
+    if passed:
+        print("✅ Adapter test PASSED - correct FunctionGemma format")
+    else:
+        print("❌ Adapter test FAILED - incorrect format")
+    return passed
 
 
 def step_fuse(args) -> bool:
@@ -129,15 +182,37 @@ def step_fuse(args) -> bool:
     print("STEP 4: Fuse Adapters")
     print("=" * 60)
     
-    cmd = [
-        sys.executable, "-m", "mlx_lm", "fuse",
-        "--model", args.base_model,
-        "--adapter-path", str(args.adapter_dir),
-        "--save-path", str(args.fused_dir),
-        "--dequantize",
-    ]
+    # Same steps as mlx_lm fuse, applied to the model the adapter test loaded
+    try:
+        from mlx.utils import tree_unflatten
+        from mlx_lm.utils import dequantize_model, save
+        
+        model, tokenizer, config = load_adapted_model(args)
+        # Dequantizing a full-precision model is a no-op that still rewrites every weight
+        dequantize = "quantization" in config or "quantization_config" in config
+        
+        fused_linears = [
+            (name, module.fuse(dequantize))
+            for name, module in model.named_modules()
+            if hasattr(module, "fuse")
+        ]
+        if fused_linears:
+            model.update_modules(tree_unflatten(fused_linears))
+        if dequantize:
+            model = dequantize_model(model)
+            config.pop("quantization", None)
+            config.pop("quantization_config", None)
+        
+        # save resolves a Hub id in base_model itself; keep the weights for step 5
+        save(args.fused_dir, args.base_model, model, tokenizer, config, donate_model=False)
+        args.mlx_model = (model, tokenizer, config)
+        args.mlx_model_fused = True
+    except Exception as e:
+        print(f"❌ Fuse failed: {e}")
+        return False
     
-    return run_cmd(cmd, cwd=args.base_dir) is not None
+    print(f"✅ Fused model saved to {args.fused_dir}")
+    return True
 
 
 def step_test_fused(args) -> bool:
@@ -146,35 +221,22 @@ def step_test_fused(args) -> bool:
     print("STEP 5: Test Fused Model (Post-Fusion)")
     print("=" * 60)
     
-    test_code = f'''
-from mlx_lm import load, generate
-
-model, tokenizer = load("{args.fused_dir}")
-
-prompt = """<bos><start_of_turn>developer
-You are a model that can do function calling.
-Must use: <start_function_call>call:name{{arg:<escape>val<escape>}}<end_function_call>
-<start_function_declaration>declaration:calculate{{description:<escape>Math<escape>,parameters:{{}},required:[],type:<escape>OBJECT<escape>}}<end_function_declaration>
-<end_of_turn>
-<start_of_turn>user
-What is 5 * 12?<end_of_turn>
-<start_of_turn>model
-"""
-
-response = generate(model, tokenizer, prompt=prompt, max_tokens=60, verbose=False)
-print("Response:", response)
-
-if "<start_function_call>call:" in response and "<escape>" in response:
-    print("✅ Fused model test PASSED")
-    exit(0)
-else:
-    print("❌ Fused model test FAILED")
-    exit(1)
-'''
+    try:
+        if getattr(args, "mlx_model_fused", False):
+            model, tokenizer, _ = args.mlx_model
+        else:
+            from mlx_lm import load
+            model, tokenizer = load(str(args.fused_dir))
+        passed = check_function_call(model, tokenizer)
+    except Exception as e:
+        print(f"❌ Fused model test error: {e}")
+        return False
     
-    cmd = [sys.executable, "-c", test_code]
-    result = run_cmd(cmd, cwd=args.base_dir, check=False)
-    return result is not None and result.returncode == 0
+    if passed:
+        print("✅ Fused model test PASSED")
+    else:
+        print("❌ Fused model test FAILED")
+    return passed
 
 
 def step_export_onnx(args) -> bool:
@@ -196,7 +258,7 @@ def step_export_onnx(args) -> bool:
     # Always prepare for browser deployment
     cmd.append("--prepare-browser")
     
-    return run_cmd(cmd, cwd=args.base_dir) is not None
+    return run_cmd(cmd, cwd=args.base_dir, stream=True) is not None
 
 
 def main():
@@ -250,11 +312,33 @@ def main():
     parser.add_argument("--skip-training", action="store_true", help="Skip training")
     parser.add_argument("--skip-tests", action="store_true", help="Skip all tests")
     parser.add_argument("--skip-onnx", action="store_true", help="Skip ONNX export")
+    parser.add_argument(
+        "--serial", action="store_true",
+        help="Run every step in order in this process (no overlap of adapter test and fusion, "
+             "but the adapter test and fusion share one model load)"
+    )
     
     args = parser.parse_args()
     
-    # Set up paths
-    args.base_dir = Path(__file__).parent.parent
+    # The export runs last, so check its dependency before spending time on training and fusion
+    if not args.skip_onnx:
+        import importlib.util
+        try:
+            # Imports the parent packages, so a broken install raises here
+            found = importlib.util.find_spec("optimum.exporters.onnx") is not None
+        except ModuleNotFoundError:
+            found = False
+        except ImportError as e:
+            print(f"⚠️  optimum is installed but fails to import: {e}")
+            found = False
+        if not found:
+            print("❌ optimum not installed; rerun with --skip-onnx or pip install optimum-onnx onnxruntime")
+            return 1
+    
+    # Set up paths (training and fusion run in this process, so resolve
+    # against the package dir the way the cwd= subprocesses used to)
+    args.base_dir = Path(__file__).resolve().parent.parent
+    args.output_dir = args.base_dir / args.output_dir
     args.data_dir = args.base_dir / "training-data"
     args.adapter_dir = args.base_dir / "training-output" / "adapters"
     args.fused_dir = args.output_dir / "fused-model"
@@ -279,14 +363,37 @@ def main():
         ("Export ONNX", step_export_onnx, args.skip_onnx),
     ]
     
-    for name, step_fn, skip in steps:
-        if skip:
-            print(f"\n⏭️  Skipping: {name}")
-            continue
+    # The pre-fusion test only reads the base model and adapters, so it runs in
+    # a worker while fusion proceeds here; it is joined after the next step
+    pool = None if args.serial else ProcessPoolExecutor(max_workers=1)
+    pending = None
+    try:
+        for name, step_fn, skip in steps:
+            if skip:
+                print(f"\n⏭️  Skipping: {name}")
+                continue
+            
+            if step_fn is step_test_adapters and pool is not None:
+                pending = (name, pool.submit(step_fn, args))
+                continue
+            
+            if not step_fn(args):
+                print(f"\n❌ Pipeline failed at: {name}")
+                return 1
+            
+            if pending is not None:
+                pending_name, future = pending
+                pending = None
+                if not future.result():
+                    print(f"\n❌ Pipeline failed at: {pending_name}")
+                    return 1
         
-        if not step_fn(args):
-            print(f"\n❌ Pipeline failed at: {name}")
+        if pending is not None and not pending[1].result():
+            print(f"\n❌ Pipeline failed at: {pending[0]}")
             return 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
     
     print("\n" + "=" * 60)
     print("✅ Pipeline Complete!")
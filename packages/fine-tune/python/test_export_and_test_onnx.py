@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Tests for export_and_test_onnx.py helpers.
+
+These tests build tiny ONNX graphs in memory, so no exported model is needed.
+Run with: python -m pytest python/test_export_and_test_onnx.py -v
+"""
+
+import os
+import pytest
+import sys
+from pathlib import Path
+
+# Add python dir to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+np = pytest.importorskip("numpy")
+onnx = pytest.importorskip("onnx")
+ort = pytest.importorskip("onnxruntime")
+
+from onnx import TensorProto, helper, numpy_helper
+
+import export_and_test_onnx
+from export_and_test_onnx import (
+    _convert_fp16,
+    _evict_export_cache,
+    _link_tree,
+    _opt_graph_stamp,
+    _quantize_block,
+    _quantize_matmuls_q4,
+    prepare_for_browser,
+)
+
+
+def dequantize_q4(packed, scales, k: int):
+    """Reference MatMulNBits dequantization: low nibble first, zero point 8, back to [K, N]."""
+    n, n_blocks, half_block = packed.shape
+    q = np.empty((n, n_blocks, half_block * 2), dtype=np.float32)
+    q[..., 0::2] = packed & 0x0F
+    q[..., 1::2] = packed >> 4
+    w = (q - 8) * scales.reshape(n, n_blocks, 1)
+    return w.reshape(n, -1)[:, :k].T
+
+
+def make_matmul_model(k: int = 16, n: int = 8):
+    """A one-MatMul FP32 model: y = x @ W."""
+    weight = numpy_helper.from_array(np.random.default_rng(0).random((k, n), dtype=np.float32), "W")
+    graph = helper.make_graph(
+        [helper.make_node("MatMul", ["x", "W"], ["y"], name="matmul")],
+        "matmul",
+        [helper.make_tensor_value_info("x", TensorProto.FLOAT, [1, k])],
+        [helper.make_tensor_value_info("y", TensorProto.FLOAT, [1, n])],
+        [weight],
+    )
+    # IR 8 loads on every onnxruntime this package supports
+    return helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+
+
+class TestConvertFp16:
+    """Tests for _convert_fp16()."""
+
+    @pytest.mark.parametrize("external", [False, True], ids=["embedded", "external_data"])
+    def test_converts_and_runs(self, tmp_path, external):
+        """Test that weights become FP16, IO stays FP32 and the result runs in ORT."""
+        model_file = tmp_path / "model.onnx"
+        onnx.save(
+            make_matmul_model(),
+            str(model_file),
+            save_as_external_data=external,
+            size_threshold=0,
+            location="model.onnx_data",
+        )
+
+        model_fp16 = _convert_fp16(model_file)
+
+        weight = next(init for init in model_fp16.graph.initializer if init.name == "W")
+        assert weight.data_type == TensorProto.FLOAT16
+        assert model_fp16.graph.input[0].type.tensor_type.elem_type == TensorProto.FLOAT
+        assert model_fp16.graph.output[0].type.tensor_type.elem_type == TensorProto.FLOAT
+
+        fp16_file = tmp_path / "fp16" / "model.onnx"
+        fp16_file.parent.mkdir()
+        onnx.save(model_fp16, str(fp16_file))
+        session = ort.InferenceSession(str(fp16_file), providers=["CPUExecutionProvider"])
+        x = np.ones((1, 16), dtype=np.float32)
+        expected = x @ numpy_helper.to_array(make_matmul_model().graph.initializer[0])
+        (y,) = session.run(None, {"x": x})
+        assert y.dtype == np.float32
+        np.testing.assert_allclose(y, expected, rtol=1e-2)
+
+
+class TestQuantizeQ4:
+    """Tests for _quantize_block() and _quantize_matmuls_q4()."""
+
+    def test_block_layout(self):
+        """Test packed/scales shapes, zero point 8 and reconstruction, with K padded to a block."""
+        weight = np.random.default_rng(1).standard_normal((40, 8)).astype(np.float32)
+        weight[:, 3] = 0.0
+
+        packed, scales = _quantize_block(weight, 16)
+
+        assert packed.dtype == np.uint8 and packed.shape == (8, 3, 8)
+        assert scales.dtype == np.float32 and scales.shape == (24,)
+        # An all-zero column quantizes to the zero point in every nibble
+        assert (packed[3] == 0x88).all()
+        assert (scales.reshape(8, 3)[3] == 0).all()
+        deq = dequantize_q4(packed, scales, 40)
+        assert deq.shape == weight.shape
+        max_scale = np.abs(scales).reshape(8, 3).repeat(16, axis=1)[:, :40].T
+        assert (np.abs(deq - weight) <= 4 * max_scale + 1e-6).all()
+        assert np.abs(deq - weight).mean() < np.abs(weight).mean() / 4
+
+    def test_matmulnbits_matches_reference(self, tmp_path):
+        """Test that ORT's MatMulNBits on the rewritten graph matches x @ dequantized W."""
+        model = make_matmul_model(k=64, n=32)
+        weight = numpy_helper.to_array(model.graph.initializer[0])
+
+        assert _quantize_matmuls_q4(model, 32, workers=1) == 1
+
+        assert [node.op_type for node in model.graph.node] == ["MatMulNBits"]
+        inits = {init.name: numpy_helper.to_array(init) for init in model.graph.initializer}
+        assert "W" not in inits
+        expected_w = dequantize_q4(inits["W_Q4"], inits["W_scales"], 64)
+        assert np.abs(expected_w - weight).max() < np.abs(weight).max() / 4
+
+        model_file = tmp_path / "model.onnx"
+        onnx.save(model, str(model_file))
+        session = ort.InferenceSession(str(model_file), providers=["CPUExecutionProvider"])
+        x = np.random.default_rng(2).standard_normal((1, 64)).astype(np.float32)
+        (y,) = session.run(None, {"x": x})
+        np.testing.assert_allclose(y, x @ expected_w, rtol=1e-4, atol=1e-4)
+
+
+class TestOptGraphStamp:
+    """Tests for _opt_graph_stamp()."""
+
+    def test_tracks_files_and_providers(self, tmp_path):
+        """Test that the stamp changes with the model file or providers, and is stable otherwise."""
+        model_file = tmp_path / "model.onnx"
+        onnx.save(make_matmul_model(), str(model_file))
+        stamp = _opt_graph_stamp(model_file, ["CPUExecutionProvider"])
+
+        assert _opt_graph_stamp(model_file, ["CPUExecutionProvider"]) == stamp
+        assert _opt_graph_stamp(model_file, ["CoreMLExecutionProvider", "CPUExecutionProvider"]) != stamp
+
+        onnx.save(make_matmul_model(k=32), str(model_file))
+        assert _opt_graph_stamp(model_file, ["CPUExecutionProvider"]) != stamp
+
+    def test_tracks_hardlink_swaps(self, tmp_path):
+        """Test that relinking model.onnx to another file with the same size and mtime changes the stamp."""
+        model_file = tmp_path / "model.onnx"
+        onnx.save(make_matmul_model(), str(model_file))
+        other = tmp_path / "other.onnx"
+        other.write_bytes(model_file.read_bytes())
+        st = model_file.stat()
+        os.utime(other, ns=(st.st_atime_ns, st.st_mtime_ns))
+        stamp = _opt_graph_stamp(model_file, ["CPUExecutionProvider"])
+
+        model_file.unlink()
+        os.link(other, model_file)
+        assert _opt_graph_stamp(model_file, ["CPUExecutionProvider"]) != stamp
+
+
+class TestLinkTree:
+    """Tests for _link_tree()."""
+
+    def test_mirrors_and_drops_stale_files(self, tmp_path):
+        """Test that restoring an export removes files an earlier export left behind."""
+        src = tmp_path / "cache"
+        (src / "sub").mkdir(parents=True)
+        (src / "model.onnx").write_bytes(b"A")
+        (src / "sub" / "config.json").write_text("{}")
+        dst = tmp_path / "out"
+        (dst / "sub").mkdir(parents=True)
+        (dst / "model.onnx").write_bytes(b"B")
+        (dst / "model.opt.onnx").write_bytes(b"stale")
+        (dst / "sub" / "old.json").write_text("{}")
+
+        _link_tree(src, dst)
+
+        assert (dst / "model.onnx").read_bytes() == b"A"
+        assert (dst / "sub" / "config.json").exists()
+        assert not (dst / "model.opt.onnx").exists()
+        assert not (dst / "sub" / "old.json").exists()
+
+
+class TestEvictExportCache:
+    """Tests for _evict_export_cache()."""
+
+    def test_keeps_most_recent(self, tmp_path, monkeypatch):
+        """Test that only the newest entries (plus the one in use) survive."""
+        monkeypatch.setattr(export_and_test_onnx, "EXPORT_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(export_and_test_onnx, "EXPORT_CACHE_MAX_ENTRIES", 2)
+        for age, name in enumerate(["newest", "newer", "old", "oldest"]):
+            (tmp_path / name).mkdir()
+            os.utime(tmp_path / name, (1e9 - age, 1e9 - age))
+        (tmp_path / ".staging-x").mkdir()
+
+        _evict_export_cache(keep=tmp_path / "oldest")
+
+        remaining = sorted(p.name for p in tmp_path.iterdir())
+        assert remaining == [".staging-x", "newer", "newest", "oldest"]
+
+
+class TestPrepareForBrowser:
+    """Tests for prepare_for_browser()."""
+
+    def test_moves_external_data_with_model(self, tmp_path):
+        """Test that onnx/model.onnx still loads when its weights are in a sidecar file."""
+        onnx.save(
+            make_matmul_model(),
+            str(tmp_path / "model.onnx"),
+            save_as_external_data=True,
+            size_threshold=0,
+            location="model.onnx_data",
+        )
+
+        assert prepare_for_browser(tmp_path)
+
+        assert not (tmp_path / "model.onnx_data").exists()
+        assert (tmp_path / "onnx" / "model.onnx_data").exists()
+        session = ort.InferenceSession(str(tmp_path / "onnx" / "model.onnx"), providers=["CPUExecutionProvider"])
+        (y,) = session.run(None, {"x": np.ones((1, 16), dtype=np.float32)})
+        assert y.shape == (1, 8)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -14,19 +14,22 @@ from pathlib import Path
 # Add python dir to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
+import generate_training_data
 from generate_training_data import (
+    build_system_prompt,
     format_tool_declaration,
     format_function_call,
     generate_training_sample,
+    split_samples,
+    write_jsonl,
 )
 
 
-class TestFormatToolDeclaration:
-    """Tests for format_tool_declaration()."""
-
-    def test_basic_tool(self):
-        """Test basic tool with one required parameter."""
-        tool = {
+# (tool, substrings the declaration must contain)
+TOOL_DECLARATION_CASES = {
+    # Basic tool with one required parameter
+    "basic_tool": (
+        {
             "name": "calculate",
             "description": "Evaluate a mathematical expression",
             "parameters": {
@@ -39,27 +42,17 @@ class TestFormatToolDeclaration:
                 },
                 "required": ["expression"]
             }
-        }
-        
-        result = format_tool_declaration(tool)
-        
-        # Check structure
-        assert result.startswith("<start_function_declaration>declaration:calculate{")
-        assert result.endswith("}<end_function_declaration>")
-        
-        # Check description
-        assert "description:<escape>Evaluate a mathematical expression<escape>" in result
-        
-        # Check parameter
-        assert "expression:{description:<escape>Math expression<escape>" in result
-        assert "type:<escape>STRING<escape>" in result
-        
-        # Check required
-        assert "required:[<escape>expression<escape>]" in result
-
-    def test_tool_with_multiple_params(self):
-        """Test tool with multiple parameters."""
-        tool = {
+        },
+        [
+            "description:<escape>Evaluate a mathematical expression<escape>",
+            "expression:{description:<escape>Math expression<escape>",
+            "type:<escape>STRING<escape>",
+            "required:[<escape>expression<escape>]",
+        ],
+    ),
+    # Tool with multiple parameters
+    "multiple_params": (
+        {
             "name": "search",
             "description": "Search the web",
             "parameters": {
@@ -70,18 +63,17 @@ class TestFormatToolDeclaration:
                 },
                 "required": ["query"]
             }
-        }
-        
-        result = format_tool_declaration(tool)
-        
-        assert "declaration:search{" in result
-        assert "query:{description:<escape>Search query<escape>" in result
-        assert "limit:{description:<escape>Max results<escape>" in result
-        assert "required:[<escape>query<escape>]" in result
-
-    def test_tool_with_enum(self):
-        """Test tool with enum parameter."""
-        tool = {
+        },
+        [
+            "declaration:search{",
+            "query:{description:<escape>Search query<escape>",
+            "limit:{description:<escape>Max results<escape>",
+            "required:[<escape>query<escape>]",
+        ],
+    ),
+    # Tool with enum parameter
+    "enum": (
+        {
             "name": "set_unit",
             "description": "Set temperature unit",
             "parameters": {
@@ -95,25 +87,43 @@ class TestFormatToolDeclaration:
                 },
                 "required": ["unit"]
             }
-        }
-        
-        result = format_tool_declaration(tool)
-        
-        assert "enum:[<escape>celsius<escape>,<escape>fahrenheit<escape>]" in result
-
-    def test_tool_with_no_parameters(self):
-        """Test tool with no parameters."""
-        tool = {
+        },
+        ["enum:[<escape>celsius<escape>,<escape>fahrenheit<escape>]"],
+    ),
+    # Tool with no parameters
+    "no_parameters": (
+        {
             "name": "get_time",
             "description": "Get current time",
             "parameters": {}
-        }
-        
+        },
+        [
+            "declaration:get_time{",
+            "parameters:{}",
+            "required:[]",
+        ],
+    ),
+}
+
+
+class TestFormatToolDeclaration:
+    """Tests for format_tool_declaration()."""
+
+    @pytest.mark.parametrize(
+        "tool,expected",
+        list(TOOL_DECLARATION_CASES.values()),
+        ids=list(TOOL_DECLARATION_CASES),
+    )
+    def test_declaration(self, tool, expected):
+        """Test declaration structure and expected fragments for each tool shape."""
         result = format_tool_declaration(tool)
         
-        assert "declaration:get_time{" in result
-        assert "parameters:{}" in result
-        assert "required:[]" in result
+        # Check structure
+        assert result.startswith(f"<start_function_declaration>declaration:{tool['name']}{{")
+        assert result.endswith("}<end_function_declaration>")
+        
+        for fragment in expected:
+            assert fragment in result
 
 
 class TestFormatFunctionCall:
@@ -134,6 +144,35 @@ class TestFormatFunctionCall:
         assert "query:<escape>weather<escape>" in result
         assert "limit:<escape>5<escape>" in result
 
+    def test_call_with_three_args(self):
+        """Test exact output for three arguments, in argument order."""
+        result = format_function_call("convert", {"value": 10, "from_unit": "km", "to_unit": "mi"})
+        
+        assert result == (
+            "<start_function_call>call:convert{"
+            "value:<escape>10<escape>,"
+            "from_unit:<escape>km<escape>,"
+            "to_unit:<escape>mi<escape>"
+            "}<end_function_call>"
+        )
+
+    def test_call_with_many_args(self):
+        """Test exact output for more than three arguments, including a JSON value."""
+        result = format_function_call(
+            "create_event",
+            {"title": "Sync", "day": "Mon", "hour": 9, "attendees": ["a", "b"], "notes": {"room": 2}},
+        )
+        
+        assert result == (
+            "<start_function_call>call:create_event{"
+            "title:<escape>Sync<escape>,"
+            "day:<escape>Mon<escape>,"
+            "hour:<escape>9<escape>,"
+            'attendees:<escape>["a", "b"]<escape>,'
+            'notes:<escape>{"room": 2}<escape>'
+            "}<end_function_call>"
+        )
+
     def test_call_with_dict_arg(self):
         """Test function call with dict argument (should be JSON serialized)."""
         result = format_function_call("update", {"data": {"key": "value"}})
@@ -226,6 +265,86 @@ class TestGenerateTrainingSample:
         assert "declaration:tool1{" in text
         assert "declaration:tool2{" in text
 
+    def test_precomputed_system_prompt(self):
+        """Test that passing a prebuilt system prompt gives the same sample."""
+        tools = [{"name": "tool1", "description": "First tool", "parameters": {}}]
+        
+        example = {
+            "userQuery": "Do something",
+            "expectedToolCalls": [{"name": "tool1", "arguments": {}}]
+        }
+        
+        system_prompt = build_system_prompt(tools)
+        
+        assert generate_training_sample(example, tools, system_prompt) == generate_training_sample(example, tools)
+
+
+
+class TestWriteJsonl:
+    """Tests for write_jsonl()."""
+
+    ITEMS = [
+        {"text": "<bos><start_of_turn>user\nHello<end_of_turn>"},
+        {"text": "unicode: é → ✓", "n": 1},
+        {"text": ""},
+    ]
+
+    @pytest.mark.parametrize("use_orjson", [True, False], ids=["orjson", "stdlib"])
+    def test_round_trip(self, tmp_path, monkeypatch, use_orjson):
+        """Test that every item reads back unchanged, one per line."""
+        if use_orjson:
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(generate_training_data, "orjson", None)
+        path = tmp_path / "out.jsonl"
+        
+        write_jsonl(path, self.ITEMS)
+        
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line) for line in lines] == self.ITEMS
+        assert path.read_bytes().endswith(b"\n")
+
+    def test_larger_than_buffer(self, tmp_path, monkeypatch):
+        """Test output spanning several buffer flushes."""
+        monkeypatch.setattr(generate_training_data, "JSONL_FLUSH_BYTES", 64)
+        items = [{"text": f"sample {i} " * 5} for i in range(100)]
+        path = tmp_path / "out.jsonl"
+        
+        write_jsonl(path, items)
+        
+        assert [json.loads(line) for line in path.read_text().splitlines()] == items
+
+    def test_empty(self, tmp_path):
+        """Test that no items give an empty file."""
+        path = tmp_path / "out.jsonl"
+        
+        write_jsonl(path, [])
+        
+        assert path.read_bytes() == b""
+
+
+class TestSplitSamples:
+    """Tests for split_samples()."""
+
+    SAMPLES = [{"text": str(i)} for i in range(50)]
+
+    def test_partition(self):
+        """Test that train and valid partition the samples at the split ratio."""
+        train, valid = split_samples(self.SAMPLES, 0.8, seed=42)
+        
+        assert len(train) == 40
+        assert len(valid) == 10
+        assert sorted(s["text"] for s in train + valid) == sorted(s["text"] for s in self.SAMPLES)
+
+    def test_seeded(self):
+        """Test that the same seed gives the same split and another seed does not."""
+        assert split_samples(self.SAMPLES, 0.8, seed=42) == split_samples(self.SAMPLES, 0.8, seed=42)
+        assert split_samples(self.SAMPLES, 0.8, seed=42) != split_samples(self.SAMPLES, 0.8, seed=7)
+
+    def test_empty(self):
+        """Test splitting no samples."""
+        assert split_samples([], 0.8, seed=42) == ([], [])
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -3,7 +3,9 @@
  * Node.js test fixture for validating ONNX models with Transformers.js
  * This mimics what the browser runtime does, but in a more debuggable environment.
  * 
- * Usage: node test_onnx_node.mjs <model_path> [prompt]
+ * Usage: node test_onnx_node.mjs <model_path> [prompt] [--json-out <file>]
+ *
+ * With --json-out, timings and memory use are also written to <file> as JSON.
  */
 
 import { pipeline, env } from '@huggingface/transformers';
@@ -14,11 +16,29 @@ import fs from 'fs';
 env.allowLocalModels = true;
 env.allowRemoteModels = false;
 
-const modelPath = process.argv[2];
-const testPrompt = process.argv[3] || "What is 5*12?";
+// Split --json-out <file> from the positional arguments
+const args = process.argv.slice(2);
+let jsonOut = null;
+const jsonOutIndex = args.indexOf('--json-out');
+if (jsonOutIndex !== -1) {
+    jsonOut = args[jsonOutIndex + 1];
+    args.splice(jsonOutIndex, 2);
+}
+
+const modelPath = args[0];
+const testPrompt = args[1] || "What is 5*12?";
+
+const result = { model_path: modelPath ? path.resolve(modelPath) : null, prompt: testPrompt, ok: false };
+
+function writeResult() {
+    if (!jsonOut) return;
+    // resourceUsage().maxRSS is in kilobytes
+    result.peak_rss_mb = process.resourceUsage().maxRSS / 1024;
+    fs.writeFileSync(jsonOut, JSON.stringify(result, null, 2));
+}
 
 if (!modelPath) {
-    console.error("Usage: node test_onnx_node.mjs <model_path> [prompt]");
+    console.error("Usage: node test_onnx_node.mjs <model_path> [prompt] [--json-out <file>]");
     console.error("Example: node test_onnx_node.mjs ./working/onnx-model-q4-int8");
     process.exit(1);
 }
@@ -36,6 +56,8 @@ console.log("");
 const configPath = path.join(absolutePath, 'config.json');
 if (!fs.existsSync(configPath)) {
     console.error(`❌ config.json not found at ${configPath}`);
+    result.error = `config.json not found at ${configPath}`;
+    writeResult();
     process.exit(1);
 }
 
@@ -75,6 +97,7 @@ console.log("");
 // Try to load the pipeline
 console.log("🔄 Loading pipeline...");
 try {
+    const loadStart = performance.now();
     const generator = await pipeline('text-generation', absolutePath, {
         local_files_only: true,
         progress_callback: (progress) => {
@@ -86,6 +109,7 @@ try {
         }
     });
     
+    result.load_ms = performance.now() - loadStart;
     console.log("\n✅ Pipeline loaded successfully!");
     console.log("");
     
@@ -96,17 +120,25 @@ try {
         { role: "user", content: testPrompt }
     ];
     
-    const result = await generator(messages, {
+    const generateStart = performance.now();
+    const output = await generator(messages, {
         max_new_tokens: 128,
         do_sample: false,
         return_full_text: false
     });
+    result.generate_ms = performance.now() - generateStart;
+    
+    const text = output[0]?.generated_text;
+    result.output = typeof text === 'string' ? text : JSON.stringify(text ?? output);
+    result.new_tokens = generator.tokenizer.encode(result.output, { add_special_tokens: false }).length;
+    result.tokens_per_second = result.new_tokens / (result.generate_ms / 1000);
+    result.ok = true;
     
     console.log("✅ Inference complete!");
     console.log("");
     console.log("📝 Output:");
     console.log("-".repeat(40));
-    console.log(result[0]?.generated_text || result);
+    console.log(text || output);
     console.log("-".repeat(40));
     
 } catch (error) {
@@ -115,9 +147,13 @@ try {
     console.error("");
     console.error("Stack trace:");
     console.error(error.stack);
+    result.error = error.message;
+    writeResult();
     process.exit(1);
 }
 
+writeResult();
+
 console.log("");
 console.log("=".repeat(60));
 console.log("✅ Test complete!");